@@ -1,11 +1,313 @@
 import cv2
+import sys
+import errno
+import struct
 import socket
+import os
+import time
+import gzip
 import threading
+import selectors
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 import numpy as np
 from urllib.parse import parse_qs, urlparse
 
-def get_camera_info(source_id):
+# libjpeg-turbo is much faster than the encoder bundled with OpenCV, use it when available
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    _tj = TurboJPEG()
+except Exception:
+    _tj = None
+
+# Numba compiles the downscale loop to parallel native code, otherwise OpenCV does it
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Probing stops at the first gap of two indices, MAX_SOURCES is only a safety limit
+MAX_SOURCES = 32
+PROBE_AHEAD = 4
+PROBE_TIMEOUT = 1.5
+
+# Q80 with 4:2:0 chroma looks the same on a live feed as Q95 but is 2-3x smaller and faster to encode
+JPEG_QUALITY = 80
+
+# Mean per-pixel difference (0-255) below which a frame counts as unchanged and isn't re-encoded.
+# Sensor noise alone stays under this, anything moving in the picture goes well over it
+FRAME_DIFF_THRESHOLD = 2.0
+
+# libjpeg-turbo and OpenCV release the GIL while encoding, so encodes on a pool run on separate cores
+ENCODER_THREADS = min(4, os.cpu_count() or 1)
+_encoder_pool = ThreadPoolExecutor(max_workers=ENCODER_THREADS)
+
+# Header for each part of the multipart stream, only the length changes per frame
+PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+
+# Gather-write the header, image and CRLF with one sendmsg() where the platform has it (not Windows)
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+# The part layout is decided once here rather than on every frame
+if HAS_SENDMSG:
+    def make_part(jpeg):
+        return (memoryview(PART_HEADER % len(jpeg)), memoryview(jpeg), memoryview(b'\r\n'))
+else:
+    def make_part(jpeg):
+        return (memoryview(PART_HEADER % len(jpeg) + jpeg + b'\r\n'),)
+
+# Linux 4.14+ can send straight from our buffers instead of copying them into the kernel,
+# which only pays off for large sends. Python doesn't export these constants yet.
+USE_ZEROCOPY = HAS_SENDMSG and sys.platform.startswith('linux')
+SO_ZEROCOPY = getattr(socket, 'SO_ZEROCOPY', 60)
+MSG_ZEROCOPY = getattr(socket, 'MSG_ZEROCOPY', 0x4000000)
+SO_EE_ORIGIN_ZEROCOPY = 5
+ZEROCOPY_MIN_SIZE = 10 * 1024
+
+# A viewer whose socket hasn't accepted a byte for this many frames has stopped reading, drop it
+CLIENT_STALL_FRAMES = 10
+
+# Optional GPU JPEG encoder (nvJPEG through nvImageCodec), switched on with --gpu
+_gpu_encoder = None
+_gpu_lock = threading.Lock()
+
+def enable_gpu_encoder():
+    global _gpu_encoder
+    try:
+        from nvidia import nvimgcodec
+        _gpu_encoder = (nvimgcodec, nvimgcodec.Encoder())
+        return True
+    except Exception as e:
+        print(f"GPU encoder not available, using the CPU: {e}")
+        return False
+
+def _encode_jpeg_gpu(gpu_encoder, frame, quality):
+    global _gpu_encoder
+    nvimgcodec, encoder = gpu_encoder
+    try:
+        params = nvimgcodec.EncodeParams(quality=quality, chroma_subsampling=nvimgcodec.ChromaSubsampling.CSS_420)
+        # nvImageCodec expects RGB, the colour swap is cheap next to the encode it saves
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with _gpu_lock:
+            return encoder.encode(rgb, "jpeg", params)
+    except Exception as e:
+        print(f"GPU encode failed, falling back to the CPU: {e}")
+        _gpu_encoder = None
+        return None
+
+def encode_jpeg(frame, quality=JPEG_QUALITY):
+    # Read once, another encoder thread may switch the GPU off at any moment
+    gpu_encoder = _gpu_encoder
+    if gpu_encoder is not None:
+        jpeg = _encode_jpeg_gpu(gpu_encoder, frame, quality)
+        if jpeg is not None:
+            return jpeg
+    
+    if _tj is not None:
+        return _tj.encode(frame, quality=quality, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420)
+    
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality,
+                    int(cv2.IMWRITE_JPEG_PROGRESSIVE), 0,
+                    int(cv2.IMWRITE_JPEG_OPTIMIZE), 0]
+    # The sampling factor option only exists in OpenCV 4.5.5 and later
+    if hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR'):
+        encode_param += [int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR), int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420)]
+    _, jpeg = cv2.imencode('.jpg', frame, encode_param)
+    # Share the encoder's buffer instead of copying it out with tobytes()
+    return memoryview(jpeg).cast('B')
+
+HTML_TEMPLATE = '''
+<html>
+<head>
+    <title>{camera_title}</title>
+    <style>
+        body {{
+            margin: 0;
+            padding: 0;
+            background: #000;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            min-height: 100vh;
+            font-family: Arial, sans-serif;
+        }}
+        .container {{
+            position: relative;
+            width: 100%;
+            max-width: 1280px;
+        }}
+        .video-feed {{
+            width: 100%;
+            height: auto;
+            cursor: pointer;
+        }}
+        .fullscreen {{
+            position: fixed;
+            top: 0;
+            left: 0;
+            width: 100%;
+            height: 100%;
+            object-fit: contain;
+            z-index: 9999;
+        }}
+        .controls {{
+            position: fixed;
+            bottom: 20px;
+            left: 50%;
+            transform: translateX(-50%);
+            background: rgba(0, 0, 0, 0.5);
+            padding: 10px 20px;
+            border-radius: 5px;
+            z-index: 10000;
+            transition: opacity 0.3s ease;
+            color: white;
+            text-align: center;
+        }}
+        .controls.hidden {{
+            opacity: 0;
+            pointer-events: none;
+        }}
+        .title {{
+            margin-bottom: 10px;
+            font-size: 14px;
+            font-weight: bold;
+        }}
+        button {{
+            background: #fff;
+            border: none;
+            padding: 8px 15px;
+            border-radius: 4px;
+            cursor: pointer;
+            font-size: 14px;
+        }}
+        button:hover {{
+            background: #ddd;
+        }}
+        .controls:hover {{
+            opacity: 1 !important;
+        }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <img src="/stream" class="video-feed" id="videoFeed" alt="Video Stream">
+        <div class="controls" id="controls">
+            <div class="title">{camera_title}</div>
+            <button onclick="toggleFullScreen()">Toggle Fullscreen</button>
+        </div>
+    </div>
+    <script>
+        const videoFeed = document.getElementById('videoFeed');
+        const controls = document.getElementById('controls');
+        let controlsTimeout;
+
+        function toggleFullScreen() {{
+            videoFeed.classList.toggle('fullscreen');
+            
+            if (document.fullscreenElement) {{
+                document.exitFullscreen();
+            }} else if (videoFeed.classList.contains('fullscreen')) {{
+                document.documentElement.requestFullscreen().catch(err => {{
+                    console.log(err);
+                }});
+            }}
+        }}
+
+        function updateControlsVisibility() {{
+            if (document.fullscreenElement) {{
+                controls.style.opacity = '0';
+            }} else {{
+                controls.style.opacity = '1';
+            }}
+        }}
+
+        function showControlsTemporarily() {{
+            if (document.fullscreenElement) {{
+                controls.style.opacity = '1';
+                clearTimeout(controlsTimeout);
+                controlsTimeout = setTimeout(() => {{
+                    controls.style.opacity = '0';
+                }}, 2000);
+            }}
+        }}
+
+        document.addEventListener('mousemove', showControlsTemporarily);
+        videoFeed.addEventListener('dblclick', toggleFullScreen);
+        document.addEventListener('fullscreenchange', () => {{
+            if (!document.fullscreenElement) {{
+                videoFeed.classList.remove('fullscreen');
+            }}
+            updateControlsVisibility();
+        }});
+    </script>
+</body>
+</html>
+'''
+
+if HAS_NUMBA:
+    # Compiled up front for contiguous 8-bit BGR frames, the only thing the camera gives us,
+    # so there is no type dispatch per call and LLVM can vectorise for the known layout
+    @njit('void(uint8[:, :, ::1], uint8[:, :, ::1], int64)', parallel=True, nogil=True, cache=True)
+    def _box_downsample(src, dst, factor):
+        # Average each factor x factor block of BGR pixels, rows are split across cores
+        area = factor * factor
+        for y in prange(dst.shape[0]):
+            for x in range(dst.shape[1]):
+                for c in range(dst.shape[2]):
+                    total = 0
+                    for dy in range(factor):
+                        for dx in range(factor):
+                            total += src[y * factor + dy, x * factor + dx, c]
+                    dst[y, x, c] = total // area
+
+def downscale(frame, factor, out=None):
+    # Shrink by an integer factor into out, which is reused between frames when given
+    height, width = frame.shape[0] // factor, frame.shape[1] // factor
+    if out is None or out.shape != (height, width, frame.shape[2]):
+        out = np.empty((height, width, frame.shape[2]), dtype=np.uint8)
+    
+    if HAS_NUMBA:
+        _box_downsample(frame, out, factor)
+    else:
+        cv2.resize(frame, (width, height), dst=out, interpolation=cv2.INTER_AREA)
+    return out
+
+def is_jpeg(frame):
+    # Undecoded MJPG frames come back from OpenCV as a single row of bytes
+    return (frame.dtype == np.uint8 and (frame.ndim == 1 or frame.shape[0] == 1)
+            and frame.size > 2 and frame.flat[0] == 0xFF and frame.flat[1] == 0xD8)
+
+def frame_sample(frame):
+    # A sparse 1/64 sample of the frame, comparing two of these is far cheaper than an encode.
+    # Copied because the frame buffer gets reused
+    return frame[::8, ::8].copy()
+
+def frame_unchanged(sample, last_sample):
+    # Sensor noise means a static scene never repeats exactly, so allow a small difference.
+    # last_sample is from the last encoded frame, so a slow drift still gets re-encoded eventually
+    return (last_sample is not None and sample.shape == last_sample.shape
+            and cv2.absdiff(sample, last_sample).mean() < FRAME_DIFF_THRESHOLD)
+
+@functools.lru_cache(maxsize=1)
+def _list_usb_cameras():
+    # Enumerating PnP devices over WMI is slow, only do it once
+    names = []
+    try:
+        import win32com.client
+        wmi = win32com.client.GetObject("winmgmts:")
+        cameras = wmi.InstancesOf("Win32_PnPEntity")
+        for camera in cameras:
+            if "USB" in str(camera.Name) and "Camera" in str(camera.Name):
+                names.append(camera.Name)
+    except:
+        pass
+    return names
+
+def get_camera_info(source_id, keep_open=False):
     cap = cv2.VideoCapture(source_id)
     if not cap.isOpened():
         return None
@@ -19,215 +321,630 @@ def get_camera_info(source_id):
     
     # Read one frame to check if camera is working
     ret, frame = cap.read()
-    cap.release()
+    if not ret or not keep_open:
+        cap.release()
     
     if not ret:
         return None
         
     # On Windows, you might get additional camera info
-    try:
-        import win32com.client
-        wmi = win32com.client.GetObject("winmgmts:")
-        cameras = wmi.InstancesOf("Win32_PnPEntity")
-        for camera in cameras:
-            if "USB" in str(camera.Name) and "Camera" in str(camera.Name):
-                return {
-                    'id': source_id,
-                    'name': camera.Name,
-                    'resolution': f"{width}x{height}",
-                    'backend': backend
-                }
-    except:
-        pass
+    usb_cameras = _list_usb_cameras()
+    if usb_cameras:
+        info = {
+            'id': source_id,
+            'name': usb_cameras[0],
+            'resolution': f"{width}x{height}",
+            'backend': backend
+        }
+    else:
+        # Default camera info if specific name cannot be retrieved
+        info = {
+            'id': source_id,
+            'name': f"Camera {source_id}",
+            'resolution': f"{width}x{height}",
+            'backend': backend
+        }
+    
+    # Opening a camera is slow, hand back the working capture so it doesn't have to be opened again
+    if keep_open:
+        info['cap'] = cap
+    return info
+
+class CaptureThread(threading.Thread):
+    # Reads the camera once and shares the latest encoded frame with every viewer
+    def __init__(self, cap):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.published = 0
+        self.latest_jpeg = None
+        self.latest_frame = None
+        self.running = True
+        # Decoded frames are retrieved into recycled buffers rather than a new array each time,
+        # a buffer is reused once the encoders, the broadcaster and the latest slot are done with it
+        self.free_buffers = []
+        self.holds = {}
+        # Last encode submitted and the sample of the frame it was for, so unchanged frames reuse it
+        self.last_encode = None
+        self.last_sample = None
+        # Called after every new frame is published
+        self.listeners = []
+        self.passthrough = self._enable_passthrough()
+    
+    def _enable_passthrough(self):
+        # If the camera is already sending MJPG, ask OpenCV for the compressed frames
+        # so they can be streamed as they are instead of being decoded and re-encoded
+        fourcc = int(self.cap.get(cv2.CAP_PROP_FOURCC))
+        if fourcc != cv2.VideoWriter_fourcc(*'MJPG'):
+            return False
+        return self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    
+    def run(self):
+        index = 0
+        shape = None
+        # Never queue more encodes than there are encoder threads, drop frames instead
+        encode_slots = threading.BoundedSemaphore(ENCODER_THREADS)
+        
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        interval = 1.0 / (fps if fps > 0 else 30)
+        next_time = time.perf_counter()
+        
+        while self.running:
+            # Pace the loop to the camera's frame rate, going any faster only picks up stale frames
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+                next_time += interval
+            else:
+                next_time = time.perf_counter() + interval
+            
+            # grab() only takes the frame from the driver, it isn't decoded until retrieve()
+            if not self.cap.grab():
+                # Don't spin on a camera that is briefly unavailable
+                time.sleep(0.005)
+                continue
+            index += 1
+            
+            if self.passthrough:
+                ret, frame = self.cap.retrieve()
+                if not ret:
+                    continue
+                if not is_jpeg(frame):
+                    # The backend ignored the request, go back to decoded frames
+                    self.passthrough = False
+                    self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                    continue
+                self._publish(index, memoryview(frame).cast('B'), None)
+                continue
+            
+            # Every encoder is busy, skip this frame without paying for its decode
+            if not encode_slots.acquire(blocking=False):
+                continue
+            
+            buf = self._take_buffer(shape)
+            ret, frame = self.cap.retrieve(buf)
+            if not ret:
+                encode_slots.release()
+                self.release_frame(buf)
+                continue
+            if frame is not buf:
+                # OpenCV allocated its own array, e.g. because the size changed
+                self.release_frame(buf)
+                self._hold(frame)
+            shape = frame.shape
+            
+            # A static scene produces the same frame over and over, only encode it once
+            sample = frame_sample(frame)
+            last_encode = self.last_encode
+            if last_encode is None or not frame_unchanged(sample, self.last_sample):
+                self._hold(frame)
+                last_encode = self.last_encode = _encoder_pool.submit(encode_jpeg, frame)
+                self.last_sample = sample
+                last_encode.add_done_callback(
+                    lambda f, frame=frame: self._encode_done(frame, encode_slots))
+            else:
+                encode_slots.release()
+            
+            # Encodes finish on the pool while we keep capturing, publish each one as it's done
+            last_encode.add_done_callback(
+                lambda f, index=index, frame=frame: self._encode_finished(f, index, frame))
+    
+    def _take_buffer(self, shape):
+        # Reuse a frame buffer nothing is holding any more instead of allocating a new one
+        if shape is None:
+            return None
+        with self.condition:
+            while self.free_buffers:
+                buf = self.free_buffers.pop()
+                if buf.shape == shape:
+                    break
+            else:
+                buf = np.empty(shape, dtype=np.uint8)
+            self.holds[id(buf)] = [buf, 1]
+        return buf
+    
+    def _hold(self, frame):
+        if frame is None:
+            return
+        with self.condition:
+            # The entry keeps the array alive so its id can't be reused while it's counted
+            self.holds.setdefault(id(frame), [frame, 0])[1] += 1
+    
+    def release_frame(self, frame):
+        if frame is None:
+            return
+        with self.condition:
+            entry = self.holds.get(id(frame))
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.holds[id(frame)]
+                self.free_buffers.append(frame)
+    
+    def _encode_done(self, frame, encode_slots):
+        encode_slots.release()
+        self.release_frame(frame)
+    
+    def _encode_finished(self, future, index, frame):
+        try:
+            jpeg = future.result()
+        except Exception as e:
+            print(f"Encoding error: {e}")
+            self.release_frame(frame)
+            # Don't let later unchanged frames reuse the failed encode, encode the next one again
+            with self.condition:
+                if self.last_encode is future:
+                    self.last_encode = None
+                    self.last_sample = None
+            return
+        self._publish(index, jpeg, frame)
+    
+    def _publish(self, index, jpeg, frame):
+        # Takes over the capture loop's hold on frame
+        with self.condition:
+            # An encode of a later frame already finished first, this one is stale
+            if index <= self.published:
+                self.release_frame(frame)
+                return
+            previous = self.latest_frame
+            self.published = index
+            self.seq += 1
+            self.latest_jpeg = jpeg
+            self.latest_frame = frame
+            self.release_frame(previous)
+            self.condition.notify_all()
+        
+        for listener in self.listeners:
+            listener()
+    
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        # Block until a frame newer than last_seq is available. The frame stays
+        # untouched until the caller hands it back with release_frame()
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq != last_seq or not self.running, timeout)
+            self._hold(self.latest_frame)
+            return self.seq, self.latest_jpeg, self.latest_frame
+    
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        
+        for listener in self.listeners:
+            listener()
+
+class StreamClient:
+    def __init__(self, sock, quality, width=None):
+        self.sock = sock
+        self.quality = quality
+        self.width = width
+        # Unsent remainder of the current frame as a list of buffers, None once it has all gone out
+        self.pending = None
+        self.registered = False
+        # Frames skipped in a row because the socket made no progress on the previous one
+        self.stalled_frames = 0
+        
+        # Buffers handed to the kernel with MSG_ZEROCOPY must stay alive until it reports them done
+        self.zerocopy = False
+        self.zerocopy_sends = 0
+        self.zerocopy_inflight = deque()
+        if USE_ZEROCOPY:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+                self.zerocopy = True
+            except OSError:
+                pass
+
+class StreamBroadcaster(threading.Thread):
+    # Sends every new frame to all /stream viewers from one thread using non-blocking sockets
+    def __init__(self, capture):
+        super().__init__(daemon=True)
+        self.capture = capture
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.clients = []
+        # Downscaled frame buffers by factor, reused from frame to frame
+        self.scale_buffers = {}
+        
+        # The capture thread writes a byte here for every new frame, so a single select() waits
+        # for both new frames and writable sockets. It also means the selector is never empty,
+        # which Windows' select() would reject
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ, None)
+        capture.listeners.append(self.wake)
+    
+    def wake(self):
+        try:
+            self.wakeup_send.send(b'\0')
+        except OSError:
+            # Buffer full means a wakeup is already pending
+            pass
+    
+    def add_client(self, sock, quality, width=None):
+        sock.setblocking(False)
+        with self.lock:
+            self.clients.append(StreamClient(sock, quality, width))
+    
+    def run(self):
+        last_seq = 0
+        
+        while self.capture.running:
+            frame = None
+            try:
+                for key, _ in self.selector.select(timeout=1.0):
+                    if key.data is None:
+                        self._drain_wakeup()
+                    else:
+                        self._flush(key.data)
+                
+                seq, jpeg, frame = self.capture.wait_for_frame(last_seq, timeout=0)
+                if seq != last_seq and jpeg is not None:
+                    last_seq = seq
+                    self._broadcast(jpeg, frame)
+            except Exception as e:
+                # Skip this frame rather than stopping the stream for every viewer
+                print(f"Streaming error: {e}")
+            finally:
+                self.capture.release_frame(frame)
+        
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            self._drop(client)
+        self.selector.unregister(self.wakeup_recv)
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+    
+    def _drain_wakeup(self):
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except OSError:
+            pass
+    
+    def _broadcast(self, jpeg, frame):
+        with self.lock:
+            busy = [client for client in self.clients if client.pending is not None]
+            # Viewers still sending the previous frame skip this one rather than queueing it up
+            clients = [client for client in self.clients if client.pending is None]
+        
+        for client in busy:
+            client.stalled_frames += 1
+            if client.stalled_frames > CLIENT_STALL_FRAMES:
+                print("Streaming error: viewer stopped reading, dropping it")
+                self._drop(client)
+        
+        # Camera JPEGs passed straight through have no decoded frame. Decode one per frame,
+        # and only when a viewer asked for another quality or size
+        if frame is None and any(client.quality != JPEG_QUALITY or client.width for client in clients):
+            try:
+                frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            except Exception as e:
+                print(f"Streaming error: {e}")
+                frame = None
+        
+        keys = {}
+        for client in clients:
+            factor = 1
+            if client.width and frame is not None:
+                # Never shrink below one pixel in either direction, e.g. for ?w=1
+                factor = max(1, min(frame.shape[1] // client.width, frame.shape[0], frame.shape[1]))
+            keys[client] = (client.quality, factor)
+        
+        # The shared JPEG is already at the default quality and full size. Every other
+        # combination is encoded once per frame for all viewers that asked for it, in
+        # parallel on the encoder pool
+        encodes = {}
+        for quality, factor in set(keys.values()):
+            if (quality, factor) == (JPEG_QUALITY, 1) or frame is None:
+                continue
+            try:
+                image = frame
+                if factor > 1:
+                    image = self.scale_buffers[factor] = downscale(frame, factor, self.scale_buffers.get(factor))
+                encodes[(quality, factor)] = _encoder_pool.submit(encode_jpeg, image, quality)
+            except Exception as e:
+                print(f"Streaming error: {e}")
+                encodes[(quality, factor)] = None
+        
+        parts = {}
+        for client in clients:
+            key = keys[client]
+            if key not in parts:
+                try:
+                    data = jpeg
+                    if key in encodes:
+                        data = encodes[key].result() if encodes[key] is not None else None
+                    parts[key] = make_part(data) if data is not None else None
+                except Exception as e:
+                    # Only the viewers that asked for this size and quality miss the frame
+                    print(f"Streaming error: {e}")
+                    parts[key] = None
+            
+            part = parts[key]
+            if part is None:
+                continue
+            client.pending = list(part)
+            self._flush(client)
+    
+    def _flush(self, client):
+        if client.zerocopy_inflight:
+            self._reap_zerocopy(client)
+        
+        zerocopy = client.zerocopy and sum(len(b) for b in client.pending) >= ZEROCOPY_MIN_SIZE
+        try:
+            if HAS_SENDMSG:
+                sent = client.sock.sendmsg(client.pending, [], MSG_ZEROCOPY if zerocopy else 0)
+            else:
+                sent = client.sock.send(client.pending[0])
+        except BlockingIOError:
+            sent = 0
+        except OSError as e:
+            if zerocopy and e.errno in (errno.EOPNOTSUPP, errno.ENOBUFS, errno.EINVAL):
+                # Not supported here or out of pinned memory, copy like a normal send instead
+                client.zerocopy = False
+                self._flush(client)
+                return
+            print(f"Streaming error: {e}")
+            self._drop(client)
+            return
+        
+        if sent:
+            client.stalled_frames = 0
+        
+        if zerocopy and sent:
+            client.zerocopy_inflight.append((client.zerocopy_sends, client.pending))
+            client.zerocopy_sends += 1
+        
+        pending = client.pending[:]
+        while sent and pending:
+            if sent >= len(pending[0]):
+                sent -= len(pending.pop(0))
+            else:
+                pending[0] = pending[0][sent:]
+                sent = 0
+        client.pending = pending or None
+        
+        # Only wait for the socket to become writable while part of a frame is left
+        if client.pending is not None and not client.registered:
+            self.selector.register(client.sock, selectors.EVENT_WRITE, client)
+            client.registered = True
+        elif client.pending is None and client.registered:
+            self.selector.unregister(client.sock)
+            client.registered = False
     
-    # Default camera info if specific name cannot be retrieved
-    return {
-        'id': source_id,
-        'name': f"Camera {source_id}",
-        'resolution': f"{width}x{height}",
-        'backend': backend
-    }
+    def _reap_zerocopy(self, client):
+        # Completion notices arrive on the error queue as ranges of finished sendmsg() calls
+        while client.zerocopy_inflight:
+            try:
+                _, ancdata, _, _ = client.sock.recvmsg(0, 1024, socket.MSG_ERRQUEUE)
+            except OSError:
+                return
+            
+            for _, _, data in ancdata:
+                if len(data) < 16:
+                    continue
+                _, origin, _, _, _, _, done = struct.unpack('=IBBBBII', data[:16])
+                if origin != SO_EE_ORIGIN_ZEROCOPY:
+                    continue
+                while client.zerocopy_inflight and client.zerocopy_inflight[0][0] <= done:
+                    client.zerocopy_inflight.popleft()
+    
+    def _drop(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        if client.registered:
+            self.selector.unregister(client.sock)
+            client.registered = False
+        client.sock.close()
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    # One thread per connection so a viewer never blocks the page or other viewers
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.detached = set()
+    
+    def detach(self, request):
+        # Keep the connection open after the handler returns, someone else owns it now
+        self.detached.add(request)
+    
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+            return
+        super().shutdown_request(request)
 
 class VideoStreamHandler(BaseHTTPRequestHandler):
+    # Keep-alive lets the browser fetch /stream over the same connection as the page
+    protocol_version = 'HTTP/1.1'
+    
+    def setup(self):
+        super().setup()
+        # Frames are written in one go, don't let Nagle hold them back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    
     def do_GET(self):
-        if self.path == '/':
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        
+        if url.path == '/':
+            body = self.server.index_html_bytes
+            gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+            if gzipped:
+                body = self.server.index_html_gz
+            
             self.send_response(200)
             self.send_header('Content-type', 'text/html')
+            self.send_header('Content-Length', len(body))
+            self.send_header('Vary', 'Accept-Encoding')
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
             self.end_headers()
+            self.wfile.write(body)
+        elif url.path == '/stream':
+            # Viewers can ask for their own quality with /stream?q= and a smaller
+            # picture with /stream?w=, e.g. for slow links
+            quality = JPEG_QUALITY
+            try:
+                quality = min(max(int(query['q'][0]), 1), 100)
+            except (KeyError, ValueError):
+                pass
             
-            camera_info = self.server.camera_info
-            camera_title = f"{camera_info['name']} ({camera_info['resolution']})"
+            width = None
+            try:
+                width = max(int(query['w'][0]), 1)
+            except (KeyError, ValueError):
+                pass
             
-            self.wfile.write(f'''
-                <html>
-                <head>
-                    <title>{camera_title}</title>
-                    <style>
-                        body {{
-                            margin: 0;
-                            padding: 0;
-                            background: #000;
-                            display: flex;
-                            justify-content: center;
-                            align-items: center;
-                            min-height: 100vh;
-                            font-family: Arial, sans-serif;
-                        }}
-                        .container {{
-                            position: relative;
-                            width: 100%;
-                            max-width: 1280px;
-                        }}
-                        .video-feed {{
-                            width: 100%;
-                            height: auto;
-                            cursor: pointer;
-                        }}
-                        .fullscreen {{
-                            position: fixed;
-                            top: 0;
-                            left: 0;
-                            width: 100%;
-                            height: 100%;
-                            object-fit: contain;
-                            z-index: 9999;
-                        }}
-                        .controls {{
-                            position: fixed;
-                            bottom: 20px;
-                            left: 50%;
-                            transform: translateX(-50%);
-                            background: rgba(0, 0, 0, 0.5);
-                            padding: 10px 20px;
-                            border-radius: 5px;
-                            z-index: 10000;
-                            transition: opacity 0.3s ease;
-                            color: white;
-                            text-align: center;
-                        }}
-                        .controls.hidden {{
-                            opacity: 0;
-                            pointer-events: none;
-                        }}
-                        .title {{
-                            margin-bottom: 10px;
-                            font-size: 14px;
-                            font-weight: bold;
-                        }}
-                        button {{
-                            background: #fff;
-                            border: none;
-                            padding: 8px 15px;
-                            border-radius: 4px;
-                            cursor: pointer;
-                            font-size: 14px;
-                        }}
-                        button:hover {{
-                            background: #ddd;
-                        }}
-                        .controls:hover {{
-                            opacity: 1 !important;
-                        }}
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <img src="/stream" class="video-feed" id="videoFeed" alt="Video Stream">
-                        <div class="controls" id="controls">
-                            <div class="title">{camera_title}</div>
-                            <button onclick="toggleFullScreen()">Toggle Fullscreen</button>
-                        </div>
-                    </div>
-                    <script>
-                        const videoFeed = document.getElementById('videoFeed');
-                        const controls = document.getElementById('controls');
-                        let controlsTimeout;
-
-                        function toggleFullScreen() {{
-                            videoFeed.classList.toggle('fullscreen');
-                            
-                            if (document.fullscreenElement) {{
-                                document.exitFullscreen();
-                            }} else if (videoFeed.classList.contains('fullscreen')) {{
-                                document.documentElement.requestFullscreen().catch(err => {{
-                                    console.log(err);
-                                }});
-                            }}
-                        }}
-
-                        function updateControlsVisibility() {{
-                            if (document.fullscreenElement) {{
-                                controls.style.opacity = '0';
-                            }} else {{
-                                controls.style.opacity = '1';
-                            }}
-                        }}
-
-                        function showControlsTemporarily() {{
-                            if (document.fullscreenElement) {{
-                                controls.style.opacity = '1';
-                                clearTimeout(controlsTimeout);
-                                controlsTimeout = setTimeout(() => {{
-                                    controls.style.opacity = '0';
-                                }}, 2000);
-                            }}
-                        }}
-
-                        document.addEventListener('mousemove', showControlsTemporarily);
-                        videoFeed.addEventListener('dblclick', toggleFullScreen);
-                        document.addEventListener('fullscreenchange', () => {{
-                            if (!document.fullscreenElement) {{
-                                videoFeed.classList.remove('fullscreen');
-                            }}
-                            updateControlsVisibility();
-                        }});
-                    </script>
-                </body>
-                </html>
-            '''.encode())
-        elif self.path == '/stream':
             self.send_response(200)
             self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
             self.end_headers()
             
-            try:
-                while True:
-                    ret, frame = self.server.video_source.read()
-                    if not ret:
-                        continue
-                    
-                    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 95]
-                    _, jpeg = cv2.imencode('.jpg', frame, encode_param)
-                    
-                    self.wfile.write(b'--frame\r\n')
-                    self.send_header('Content-type', 'image/jpeg')
-                    self.send_header('Content-length', len(jpeg))
-                    self.end_headers()
-                    self.wfile.write(jpeg.tobytes())
-                    self.wfile.write(b'\r\n')
-            except Exception as e:
-                print(f"Streaming error: {e}")
-                pass
+            # Hand the socket over to the broadcaster, this thread is done with it
+            self.server.detach(self.connection)
+            self.server.broadcaster.add_client(self.connection, quality, width)
+            self.close_connection = True
+        else:
+            self.send_error(404)
 
-def list_video_sources():
-    available_sources = []
-    for i in range(10):
-        info = get_camera_info(i)
+def configure_capture(cap):
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
+    # Most webcams can compress to MJPG themselves, which also fits 1080p in USB 2.0 bandwidth
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    cap.set(cv2.CAP_PROP_FPS, 30)
+    # Only keep the newest frame in the driver so what we grab is never stale
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+class ProbeThread(threading.Thread):
+    # Daemon so a camera driver that never returns can't keep the process alive at exit
+    def __init__(self, source_id):
+        super().__init__(daemon=True)
+        self.source_id = source_id
+        self.info = None
+        self.abandoned = False
+        self.lock = threading.Lock()
+    
+    def run(self):
+        info = get_camera_info(self.source_id, keep_open=True)
+        with self.lock:
+            if not self.abandoned:
+                self.info = info
+                return
         if info:
-            available_sources.append(info)
-    return available_sources
+            info['cap'].release()
+
+def _release_probe(probe):
+    # A probe we no longer want, close the camera it opened now or whenever it finishes
+    with probe.lock:
+        probe.abandoned = True
+        info, probe.info = probe.info, None
+    if info:
+        info['cap'].release()
 
+def list_video_sources():
+    # Query WMI here on the main thread, COM isn't initialised in the worker threads
+    _list_usb_cameras()
+    
+    # Camera indices are contiguous, so stop after two missing in a row instead of trying
+    # every index. A few indices ahead are probed at the same time so opens still overlap
+    sources = []
+    misses = 0
+    next_id = 0
+    pending = deque()
+    try:
+        while misses < 2:
+            while len(pending) < PROBE_AHEAD and next_id < MAX_SOURCES:
+                probe = ProbeThread(next_id)
+                probe.start()
+                pending.append(probe)
+                next_id += 1
+            if not pending:
+                break
+            
+            probe = pending.popleft()
+            probe.join(timeout=PROBE_TIMEOUT)
+            if probe.is_alive():
+                # Don't let a device that hangs while opening hold up startup
+                _release_probe(probe)
+                info = None
+            else:
+                info = probe.info
+            
+            if info:
+                sources.append(info)
+                misses = 0
+            else:
+                misses += 1
+    finally:
+        for probe in pending:
+            _release_probe(probe)
+    return sources
+
+@functools.lru_cache(maxsize=1)
 def get_local_ip():
+    # Use the address of the interface that holds the default route, so LAN viewers can reach
+    # us rather than a docker, VirtualBox or WSL adapter. netifaces is optional
+    try:
+        import netifaces
+        iface = netifaces.gateways()['default'][netifaces.AF_INET][1]
+        for addr in netifaces.ifaddresses(iface).get(netifaces.AF_INET, []):
+            if addr.get('addr'):
+                return addr['addr']
+    except Exception:
+        pass
+    
+    # Ask the OS which address it would use to reach the internet
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
         s.close()
         return ip
-    except:
-        return "127.0.0.1"
+    except OSError:
+        pass
+    
+    # Offline, fall back to whatever the host name resolves to
+    try:
+        for ip in socket.gethostbyname_ex(socket.gethostname())[2]:
+            if not ip.startswith('127.'):
+                return ip
+    except OSError:
+        pass
+    return "127.0.0.1"
 
 def main():
+    if '--gpu' in sys.argv[1:]:
+        enable_gpu_encoder()
+    
     sources = list_video_sources()
     
     if not sources:
@@ -246,17 +963,38 @@ def main():
     
     print(f"\nUsing: {selected_source['name']}")
     
+    # Keep the selected camera open from probing and close the rest
+    for source in sources:
+        if source is not selected_source:
+            source['cap'].release()
+    
     local_ip = get_local_ip()
     port = 8000
     
-    cap = cv2.VideoCapture(selected_source['id'])
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
+    cap = selected_source['cap']
+    configure_capture(cap)
     
-    server = HTTPServer((local_ip, port), VideoStreamHandler)
-    server.video_source = cap
+    # Some drivers stop delivering frames after the format changes until the camera is reopened
+    if not cap.grab():
+        cap.release()
+        cap = cv2.VideoCapture(selected_source['id'])
+        configure_capture(cap)
+    
+    capture = CaptureThread(cap)
+    capture.start()
+    
+    broadcaster = StreamBroadcaster(capture)
+    broadcaster.start()
+    
+    server = ThreadedServer((local_ip, port), VideoStreamHandler)
+    server.broadcaster = broadcaster
     server.camera_info = selected_source
     
+    # The page never changes while the server is running, render it once
+    camera_title = f"{selected_source['name']} ({selected_source['resolution']})"
+    server.index_html_bytes = HTML_TEMPLATE.format(camera_title=camera_title).encode()
+    server.index_html_gz = gzip.compress(server.index_html_bytes, 6)
+    
     print(f"\nStreaming video at: http://{local_ip}:{port}")
     print("Press Ctrl+C to stop the server")
     
@@ -265,6 +1003,9 @@ def main():
     except KeyboardInterrupt:
         pass
     finally:
+        capture.stop()
+        capture.join(timeout=2)
+        broadcaster.join(timeout=2)
         cap.release()
         server.server_close()
 